@@ -2,7 +2,8 @@
 """
 Load filtered CSV data into PostgreSQL according to the provided ER model.
 - Filters only the required columns from each CSV
-- Creates tables (DROP + CREATE) following the ER
+- Creates tables (DROP + CREATE) following the ER; tables are created UNLOGGED
+  and switched to LOGGED (with their foreign keys) once the load finishes
 - Inserts data with correct type/encoding conversions
 - Auto-discovers CSV files by pattern matching
 
@@ -25,9 +26,11 @@ Usage:
 """
 
 import argparse
+import codecs
 import csv
 import importlib.util
 import os
+import re
 import sys
 from contextlib import contextmanager
 from datetime import datetime
@@ -35,6 +38,7 @@ from decimal import Decimal, InvalidOperation
 
 import psycopg2
 import psycopg2.extras as extras
+from pgvector.psycopg2 import register_vector
 
 # Try to import sentence-transformers for embeddings
 HAS_TRANSFORMERS = False
@@ -48,6 +52,14 @@ except ImportError:
         "Warning: sentence-transformers not installed. Embeddings will not be computed."
     )
 
+# chardet is optional: only used to guess the encoding of non UTF-8 CSVs
+try:
+    import chardet
+
+    HAS_CHARDET = True
+except ImportError:
+    HAS_CHARDET = False
+
 # --- File paths (relative to repo root) ---
 ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 
@@ -55,17 +67,26 @@ ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 UAM_COD = "023"
 UAM_NIF = "Q2818013A"
 
+# Rows per INSERT statement sent by execute_values (its default is 100)
+PAGE_SIZE = 10000
 
-def to_pgvector_literal(vec):
-    """Convert a list of floats to pgvector literal format."""
-    return "[" + ",".join(f"{float(x):.10f}" for x in vec) + "]"
+# European number format -> Decimal: drop thousands dots, comma becomes dot
+_DEC_TRANS = str.maketrans({".": "", ",": "."})
+_NON_DIGITS = re.compile(r"\D")
+
+# Raw cod_universidad values seen in the CSVs -> normalized code (UAM: "23" -> "023")
+_COD_MAP = {"23": UAM_COD, '"23"': UAM_COD, "023": UAM_COD, '"023"': UAM_COD}
 
 
 def compute_transformer_embeddings(model, texts):
-    """Compute embeddings using sentence-transformers model."""
-    embeddings = model.encode(texts, convert_to_numpy=False, show_progress_bar=True)
-    # Normalize to list of lists
-    return [list(emb) for emb in embeddings]
+    """Compute embeddings using sentence-transformers model.
+
+    Returns a single (N, dim) float32 matrix; its rows are views that
+    register_vector adapts to `vector`.
+    """
+    return model.encode(
+        texts, batch_size=64, convert_to_numpy=True, show_progress_bar=True
+    )
 
 
 def to_decimal(s):
@@ -74,9 +95,8 @@ def to_decimal(s):
     s = s.strip()
     if s == "" or s.upper() == "NA" or s.upper() == "NULL":
         return None
-    # Replace european comma decimal with dot
-    s2 = s.replace(".", "")  # in case thousands separator is dot
-    s2 = s2.replace(",", ".")
+    # Replace european comma decimal with dot (thousands dots removed) in one pass
+    s2 = s.translate(_DEC_TRANS)
     try:
         return Decimal(s2)
     except InvalidOperation:
@@ -84,16 +104,33 @@ def to_decimal(s):
 
 
 def to_int(s):
-    if s is None:
+    if not s:
         return None
     s = s.strip()
-    if s == "" or not s.isdigit():
-        # try removing quotes and non-numeric
-        try:
-            return int("".join(ch for ch in s if ch.isdigit()))
-        except Exception:
-            return None
-    return int(s)
+    if not s:
+        return None
+    try:
+        return int(s)
+    except ValueError:
+        # Not a plain integer: keep only its digits (e.g. quoted ids)
+        digits = _NON_DIGITS.sub("", s)
+        return int(digits) if digits else None
+
+
+def normalize_cod_universidad(s):
+    # Common case is a single dict lookup; anything else is stripped of
+    # spaces/quotes and UAM's unpadded "23" mapped to UAM_COD
+    if s is None:
+        return ""
+    cod = _COD_MAP.get(s)
+    if cod is None:
+        cod = s.strip().strip('"')
+        cod = _COD_MAP.get(cod, cod)
+    return cod
+
+
+def to_text(s):
+    return (s or "").strip()
 
 
 def parse_date_yyyymmdd(s):
@@ -128,6 +165,59 @@ def parse_ts(s):
     return None
 
 
+# Session settings for a one-shot bulk load: don't wait for WAL flushes on
+# commit, give index builds more memory and compress full-page WAL images.
+BULK_LOAD_SETTINGS = (
+    "SET synchronous_commit = off",
+    "SET maintenance_work_mem = '1GB'",
+    "SET wal_compression = on",
+)
+
+# Parents first: a logged table cannot reference an unlogged one
+LOGGED_ORDER = (
+    "UNIVERSIDAD",
+    "CONVOCATORIA_AYUDA",
+    "PRESUPUESTO_GASTOS",
+    "PRESUPUESTO_INGRESOS",
+    "LICITACION",
+    "AYUDA",
+)
+
+
+# LICITACION columns in INSERT order, with the converter applied to each CSV value
+LICITACION_COLUMNS = (
+    ("identificador", "to_int"),
+    ("nif_oc", "to_text"),
+    ("primera_publicacion", "parse_ts"),
+    ("presupuesto_base_sin_impuestos_licitacion_o_lote", "to_decimal"),
+    ("importe_adjudicacion_sin_impuestos_licitacion_o_lote", "to_decimal"),
+    ("resultado_licitacion_o_lote", "to_text"),
+    ("identificador_adjudicatario_de_la_licitacion_o_lote", "to_text"),
+    ("objeto_licitacion_o_lote", "to_text"),
+    ("link_licitacion", "to_text"),
+    ("descripcion_de_la_financiacion_europea", "to_text"),
+)
+
+
+def build_row_converter(header, columns):
+    """Generate a function mapping a csv.reader row to an INSERT tuple.
+
+    The position of each column in ``header`` and its converter are hardcoded
+    in the generated source, so converting a row is a single call with no
+    dict building or ``.get`` lookups. Columns missing from the header are
+    converted from ``None``, as ``DictReader.get`` would return.
+    """
+    pos = {name: i for i, name in enumerate(header)}
+    items = []
+    for name, conv in columns:
+        arg = f"row[{pos[name]}]" if name in pos else "None"
+        items.append(f"{conv}({arg})")
+    src = "def convert(row):\n    return (" + ", ".join(items) + ",)\n"
+    namespace = {conv: globals()[conv] for _, conv in columns}
+    exec(compile(src, "<row_converter>", "exec"), namespace)
+    return namespace["convert"]
+
+
 def connect_db(args):
     conn = psycopg2.connect(
         host=args.host,
@@ -138,50 +228,63 @@ def connect_db(args):
     )
     # Ensure the client encoding is UTF8 so text sent to Postgres is stored as UTF-8
     conn.set_client_encoding("UTF8")
+    tune_session(conn)
     conn.autocommit = False
     return conn
 
 
+def tune_session(conn):
+    """Apply BULK_LOAD_SETTINGS to the session.
+
+    Runs in autocommit mode so a setting the role is not allowed to change
+    (e.g. wal_compression needs superuser) only prints a warning.
+    """
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        for stmt in BULK_LOAD_SETTINGS:
+            try:
+                cur.execute(stmt)
+            except psycopg2.Error as e:
+                print(f"Warning: could not apply '{stmt}': {e}")
+
+
+def detect_encoding(csv_path, sample_size=65536):
+    """Pick the encoding of a CSV from its first ``sample_size`` bytes.
+
+    A UTF-8 BOM selects utf-8-sig; a sample that decodes as UTF-8 selects
+    utf-8. Otherwise chardet (if installed) is consulted and its guess is used
+    when confident enough; latin1 is the final fallback since it never fails.
+    """
+    with open(csv_path, "rb") as f:
+        sample = f.read(sample_size)
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    try:
+        # Incremental decode tolerates a multi-byte char cut at the sample end
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+    if HAS_CHARDET:
+        guess = chardet.detect(sample)
+        if guess.get("encoding") and (guess.get("confidence") or 0) > 0.7:
+            return guess["encoding"]
+    return "latin1"
+
+
 @contextmanager
-def csv_open_reader(csv_path):
-    """Context manager that yields a csv.DictReader opened with a best-effort
-    UTF-8 encoding. It tries encodings in order: utf-8-sig, utf-8, latin1.
-    This avoids UnicodeDecodeError when CSVs have different encodings and
-    ensures text rows are returned as Python str (UTF-8 decoded).
+def csv_open_reader(csv_path, raw=False):
+    """Context manager that yields a csv.DictReader opened with the encoding
+    detected by `detect_encoding`, so text rows are returned as Python str
+    (UTF-8 decoded). The file is opened only once.
+
+    With ``raw=True`` a plain csv.reader is yielded instead (rows are lists and
+    the header is the first row), for loaders that address columns by index.
     """
-    encodings = ("utf-8-sig", "utf-8", "latin1")
-    last_exc = None
-    f = None
-    for enc in encodings:
-        try:
-            f = open(csv_path, "r", encoding=enc, newline="")
-            reader = csv.DictReader(f)
-            yield reader
-            return
-        except UnicodeDecodeError as e:
-            last_exc = e
-            if f:
-                try:
-                    f.close()
-                except Exception:
-                    pass
-            f = None
-            continue
-    # If all encodings failed to decode without error, fall back to latin1 to
-    # at least provide a best-effort decoding (latin1 never fails).
-    if f is None:
-        f = open(csv_path, "r", encoding="latin1", newline="")
-        reader = csv.DictReader(f)
-        try:
-            yield reader
-        finally:
-            f.close()
-    else:
-        # Close file if we somehow exited loop without yielding
-        try:
-            f.close()
-        except Exception:
-            pass
+    enc = detect_encoding(csv_path)
+    # 1 MiB buffer: far fewer read() calls than the 8 KiB default on large CSVs
+    with open(csv_path, "r", encoding=enc, newline="", buffering=1 << 20) as f:
+        yield csv.reader(f) if raw else csv.DictReader(f)
 
 
 def discover_csv_files(csv_dir):
@@ -237,16 +340,16 @@ DROP TABLE IF EXISTS PRESUPUESTO_GASTOS;
 DROP TABLE IF EXISTS PRESUPUESTO_INGRESOS;
 DROP TABLE IF EXISTS UNIVERSIDAD;
 
-CREATE TABLE UNIVERSIDAD (
+CREATE UNLOGGED TABLE UNIVERSIDAD (
     cod_universidad VARCHAR(10) PRIMARY KEY,
     nifoc VARCHAR(15) UNIQUE NOT NULL,
     des_universidad VARCHAR(255),
     nombre_corto VARCHAR(50)
 );
 
-CREATE TABLE PRESUPUESTO_GASTOS (
+CREATE UNLOGGED TABLE PRESUPUESTO_GASTOS (
     id_gasto SERIAL PRIMARY KEY,
-    cod_universidad VARCHAR(10) REFERENCES UNIVERSIDAD(cod_universidad),
+    cod_universidad VARCHAR(10),
     anio INT,
     des_capitulo VARCHAR(255),
     des_articulo VARCHAR(255),
@@ -256,9 +359,9 @@ CREATE TABLE PRESUPUESTO_GASTOS (
     credito_total DECIMAL(19,2)
 );
 
-CREATE TABLE PRESUPUESTO_INGRESOS (
+CREATE UNLOGGED TABLE PRESUPUESTO_INGRESOS (
     id_ingreso SERIAL PRIMARY KEY,
-    cod_universidad VARCHAR(10) REFERENCES UNIVERSIDAD(cod_universidad),
+    cod_universidad VARCHAR(10),
     anio INT,
     des_capitulo VARCHAR(255),
     des_articulo VARCHAR(255),
@@ -268,9 +371,9 @@ CREATE TABLE PRESUPUESTO_INGRESOS (
     credito_total DECIMAL(19,2)
 );
 
-CREATE TABLE LICITACION (
+CREATE UNLOGGED TABLE LICITACION (
     identificador BIGINT PRIMARY KEY,
-    nif_oc VARCHAR(15) REFERENCES UNIVERSIDAD(nifoc),
+    nif_oc VARCHAR(15),
     primera_publicacion TIMESTAMP,
     presupuesto_base_sin_impuestos_licitacion_o_lote DECIMAL(19,2),
     importe_adjudicacion_sin_impuestos_licitacion_o_lote DECIMAL(19,2),
@@ -282,24 +385,42 @@ CREATE TABLE LICITACION (
     embedding vector(384)
 );
 
-CREATE TABLE CONVOCATORIA_AYUDA (
+CREATE UNLOGGED TABLE CONVOCATORIA_AYUDA (
     cod_convocatoria VARCHAR(255) PRIMARY KEY,
-    cod_universidad VARCHAR(10) REFERENCES UNIVERSIDAD(cod_universidad),
+    cod_universidad VARCHAR(10),
     nombre_convocatoria TEXT,
     fecha_inicio_solicitudes DATE,
     fecha_fin_solicitudes DATE,
     des_categoria VARCHAR(255)
 );
 
-CREATE TABLE AYUDA (
+CREATE UNLOGGED TABLE AYUDA (
     id_ayuda SERIAL PRIMARY KEY,
-    cod_universidad VARCHAR(10) REFERENCES UNIVERSIDAD(cod_universidad),
-    cod_convocatoria_ayuda VARCHAR(255) REFERENCES CONVOCATORIA_AYUDA(cod_convocatoria),
+    cod_universidad VARCHAR(10),
+    cod_convocatoria_ayuda VARCHAR(255),
     cuantia_total DECIMAL(19,2),
     fecha_concesion DATE
 );
 """
 
+# Foreign keys are added after the bulk load (Postgres "populate a database"
+# advice): checking each FK once over the loaded table is much cheaper than a
+# per-row lookup into the parent table during the INSERTs.
+FK_SQL = r"""
+ALTER TABLE PRESUPUESTO_GASTOS ADD CONSTRAINT presupuesto_gastos_cod_universidad_fkey
+    FOREIGN KEY (cod_universidad) REFERENCES UNIVERSIDAD(cod_universidad);
+ALTER TABLE PRESUPUESTO_INGRESOS ADD CONSTRAINT presupuesto_ingresos_cod_universidad_fkey
+    FOREIGN KEY (cod_universidad) REFERENCES UNIVERSIDAD(cod_universidad);
+ALTER TABLE LICITACION ADD CONSTRAINT licitacion_nif_oc_fkey
+    FOREIGN KEY (nif_oc) REFERENCES UNIVERSIDAD(nifoc);
+ALTER TABLE CONVOCATORIA_AYUDA ADD CONSTRAINT convocatoria_ayuda_cod_universidad_fkey
+    FOREIGN KEY (cod_universidad) REFERENCES UNIVERSIDAD(cod_universidad);
+ALTER TABLE AYUDA ADD CONSTRAINT ayuda_cod_universidad_fkey
+    FOREIGN KEY (cod_universidad) REFERENCES UNIVERSIDAD(cod_universidad);
+ALTER TABLE AYUDA ADD CONSTRAINT ayuda_cod_convocatoria_ayuda_fkey
+    FOREIGN KEY (cod_convocatoria_ayuda) REFERENCES CONVOCATORIA_AYUDA(cod_convocatoria);
+"""
+
 
 def create_tables(cur):
     """Create required extension and tables.
@@ -353,10 +474,26 @@ def create_tables(cur):
         # If extension exists, proceed
         print("Note: pgvector extension already present; continuing.")
 
-    # Create all tables
+    # Create all tables (foreign keys are added later by add_foreign_keys)
     cur.execute(DDL_SQL)
 
 
+def add_foreign_keys(cur):
+    """Add the ER foreign keys once all tables are loaded.
+
+    Each constraint is validated in a single pass over the child table.
+    """
+    print("Adding foreign key constraints...")
+    cur.execute(FK_SQL)
+
+
+def set_tables_logged(cur):
+    """Turn the UNLOGGED tables created for the load into regular tables."""
+    for table in LOGGED_ORDER:
+        print(f"Setting {table} as LOGGED...")
+        cur.execute(f"ALTER TABLE {table} SET LOGGED;")
+
+
 def seed_universidad(cur):
     # Minimal seed for UAM (matches CSVs)
     cur.execute(
@@ -365,7 +502,7 @@ def seed_universidad(cur):
     )
 
 
-def load_gastos(conn, csv_files):
+def load_gastos(cur, csv_files):
     """Load PRESUPUESTO_GASTOS from one or more CSV files."""
     total_rows = 0
     for csv_path in csv_files:
@@ -373,10 +510,7 @@ def load_gastos(conn, csv_files):
         rows = []
         with csv_open_reader(csv_path) as reader:
             for r in reader:
-                cod_univ = (r.get("cod_universidad") or "").strip().strip('"')
-                # Normalize UAM code: "23" -> "023"
-                if cod_univ == "23":
-                    cod_univ = UAM_COD
+                cod_univ = normalize_cod_universidad(r.get("cod_universidad"))
                 rows.append(
                     (
                         cod_univ,
@@ -389,23 +523,24 @@ def load_gastos(conn, csv_files):
                         to_decimal(r.get("credito_total")),
                     )
                 )
-        with conn.cursor() as cur:
-            extras.execute_values(
-                cur,
-                """
-                INSERT INTO PRESUPUESTO_GASTOS (
-                    cod_universidad, anio, des_capitulo, des_articulo, des_concepto,
-                    credito_inicial, modificaciones, credito_total
-                ) VALUES %s
-                """,
-                rows,
-            )
+        extras.execute_values(
+            cur,
+            """
+            INSERT INTO PRESUPUESTO_GASTOS (
+                cod_universidad, anio, des_capitulo, des_articulo, des_concepto,
+                credito_inicial, modificaciones, credito_total
+            ) VALUES %s
+            """,
+            rows,
+            template="(%s,%s,%s,%s,%s,%s,%s,%s)",
+            page_size=PAGE_SIZE,
+        )
         total_rows += len(rows)
         print(f"  -> Inserted {len(rows)} rows from {os.path.basename(csv_path)}")
     print(f"Total PRESUPUESTO_GASTOS: {total_rows} rows")
 
 
-def load_ingresos(conn, csv_files):
+def load_ingresos(cur, csv_files):
     """Load PRESUPUESTO_INGRESOS from one or more CSV files."""
     total_rows = 0
     for csv_path in csv_files:
@@ -413,10 +548,7 @@ def load_ingresos(conn, csv_files):
         rows = []
         with csv_open_reader(csv_path) as reader:
             for r in reader:
-                cod_univ = (r.get("cod_universidad") or "").strip().strip('"')
-                # Normalize UAM code: "23" -> "023"
-                if cod_univ == "23":
-                    cod_univ = UAM_COD
+                cod_univ = normalize_cod_universidad(r.get("cod_universidad"))
                 rows.append(
                     (
                         cod_univ,
@@ -429,23 +561,24 @@ def load_ingresos(conn, csv_files):
                         to_decimal(r.get("credito_total")),
                     )
                 )
-        with conn.cursor() as cur:
-            extras.execute_values(
-                cur,
-                """
-                INSERT INTO PRESUPUESTO_INGRESOS (
-                    cod_universidad, anio, des_capitulo, des_articulo, des_concepto,
-                    credito_inicial, modificaciones, credito_total
-                ) VALUES %s
-                """,
-                rows,
-            )
+        extras.execute_values(
+            cur,
+            """
+            INSERT INTO PRESUPUESTO_INGRESOS (
+                cod_universidad, anio, des_capitulo, des_articulo, des_concepto,
+                credito_inicial, modificaciones, credito_total
+            ) VALUES %s
+            """,
+            rows,
+            template="(%s,%s,%s,%s,%s,%s,%s,%s)",
+            page_size=PAGE_SIZE,
+        )
         total_rows += len(rows)
         print(f"  -> Inserted {len(rows)} rows from {os.path.basename(csv_path)}")
     print(f"Total PRESUPUESTO_INGRESOS: {total_rows} rows")
 
 
-def load_convocatoria(conn, csv_files):
+def load_convocatoria(cur, csv_files):
     """Load CONVOCATORIA_AYUDA from one or more CSV files."""
     total_rows = 0
     for csv_path in csv_files:
@@ -453,10 +586,7 @@ def load_convocatoria(conn, csv_files):
         rows = []
         with csv_open_reader(csv_path) as reader:
             for r in reader:
-                cod_univ = (r.get("cod_universidad") or "").strip().strip('"')
-                # Normalize UAM code: "23" -> "023"
-                if cod_univ == "23":
-                    cod_univ = UAM_COD
+                cod_univ = normalize_cod_universidad(r.get("cod_universidad"))
                 rows.append(
                     (
                         (r.get("cod_convocatoria") or "").strip(),
@@ -467,31 +597,41 @@ def load_convocatoria(conn, csv_files):
                         (r.get("des_categoria") or "").strip(),
                     )
                 )
-        with conn.cursor() as cur:
-            extras.execute_values(
-                cur,
-                """
-                INSERT INTO CONVOCATORIA_AYUDA (
-                    cod_convocatoria, cod_universidad, nombre_convocatoria,
-                    fecha_inicio_solicitudes, fecha_fin_solicitudes, des_categoria
-                ) VALUES %s
-                ON CONFLICT (cod_convocatoria) DO NOTHING
-                """,
-                rows,
-            )
+        extras.execute_values(
+            cur,
+            """
+            INSERT INTO CONVOCATORIA_AYUDA (
+                cod_convocatoria, cod_universidad, nombre_convocatoria,
+                fecha_inicio_solicitudes, fecha_fin_solicitudes, des_categoria
+            ) VALUES %s
+            ON CONFLICT (cod_convocatoria) DO NOTHING
+            """,
+            rows,
+            template="(%s,%s,%s,%s,%s,%s)",
+            page_size=PAGE_SIZE,
+        )
         total_rows += len(rows)
         print(f"  -> Inserted {len(rows)} rows from {os.path.basename(csv_path)}")
     print(f"Total CONVOCATORIA_AYUDA: {total_rows} rows")
 
 
-def load_ayuda(conn, csv_files):
-    """Load AYUDA from one or more CSV files."""
-    # Obtener las convocatorias válidas ya insertadas
-    valid_conv = set()
-    with conn.cursor() as cur:
-        cur.execute("SELECT cod_convocatoria FROM CONVOCATORIA_AYUDA")
-        for (code,) in cur.fetchall():
-            valid_conv.add(code)
+def load_ayuda(cur, csv_files):
+    """Load AYUDA from one or more CSV files.
+
+    Rows are staged in a temporary table and only those whose convocatoria
+    exists in CONVOCATORIA_AYUDA are copied into AYUDA, so the FK check runs
+    as a server-side semi-join against the CONVOCATORIA_AYUDA primary key.
+    """
+    cur.execute(
+        """
+        CREATE TEMP TABLE ayuda_stg (
+            cod_universidad VARCHAR(10),
+            cod_convocatoria_ayuda VARCHAR(255),
+            cuantia_total DECIMAL(19,2),
+            fecha_concesion DATE
+        ) ON COMMIT DROP
+        """
+    )
 
     total_kept = 0
     total_skipped_empty = 0
@@ -505,17 +645,11 @@ def load_ayuda(conn, csv_files):
         skipped_missing_fk = 0
         with csv_open_reader(csv_path) as reader:
             for r in reader:
-                cod_univ = (r.get("cod_universidad") or "").strip().strip('"')
-                # Normalize UAM code: "23" -> "023"
-                if cod_univ == "23":
-                    cod_univ = UAM_COD
+                cod_univ = normalize_cod_universidad(r.get("cod_universidad"))
                 cod_conv = (r.get("cod_convocatoria_ayuda") or "").strip()
                 if not cod_conv:
                     skipped_empty += 1
                     continue
-                if cod_conv not in valid_conv:
-                    skipped_missing_fk += 1
-                    continue
                 rows.append(
                     (
                         cod_univ,
@@ -524,18 +658,34 @@ def load_ayuda(conn, csv_files):
                         None,  # fecha_concesion not present -> NULL
                     )
                 )
-                kept += 1
         if rows:
-            with conn.cursor() as cur:
-                extras.execute_values(
-                    cur,
-                    """
-                    INSERT INTO AYUDA (
-                        cod_universidad, cod_convocatoria_ayuda, cuantia_total, fecha_concesion
-                    ) VALUES %s
-                    """,
-                    rows,
+            cur.execute("TRUNCATE ayuda_stg")
+            extras.execute_values(
+                cur,
+                """
+                INSERT INTO ayuda_stg (
+                    cod_universidad, cod_convocatoria_ayuda, cuantia_total, fecha_concesion
+                ) VALUES %s
+                """,
+                rows,
+                template="(%s,%s,%s,%s)",
+                page_size=PAGE_SIZE,
+            )
+            cur.execute(
+                """
+                INSERT INTO AYUDA (
+                    cod_universidad, cod_convocatoria_ayuda, cuantia_total, fecha_concesion
+                )
+                SELECT s.cod_universidad, s.cod_convocatoria_ayuda, s.cuantia_total, s.fecha_concesion
+                FROM ayuda_stg s
+                WHERE EXISTS (
+                    SELECT 1 FROM CONVOCATORIA_AYUDA c
+                    WHERE c.cod_convocatoria = s.cod_convocatoria_ayuda
                 )
+                """
+            )
+            kept = cur.rowcount
+            skipped_missing_fk = len(rows) - kept
         total_kept += kept
         total_skipped_empty += skipped_empty
         total_skipped_missing_fk += skipped_missing_fk
@@ -547,9 +697,17 @@ def load_ayuda(conn, csv_files):
     )
 
 
-def load_licitacion(conn, csv_files):
-    """Load LICITACION from one or more CSV files."""
-    seen_ids = set()
+def load_licitacion(cur, csv_files):
+    """Load LICITACION from one or more CSV files.
+
+    Duplicate identificador values (several lotes of one licitacion) are
+    resolved by the LICITACION primary key with ON CONFLICT DO NOTHING, which
+    keeps the first occurrence.
+
+    Returns True if embeddings were stored (the caller then builds the vector
+    index with create_vector_index once the load is finished).
+    """
+    has_embeddings = False
     total_kept = 0
     total_skipped_dups = 0
     total_skipped_nif = 0
@@ -574,58 +732,46 @@ def load_licitacion(conn, csv_files):
         kept = 0
         skipped_dups = 0
         skipped_nif = 0
-        with csv_open_reader(csv_path) as reader:
+        with csv_open_reader(csv_path, raw=True) as reader:
+            header = next(reader, [])
+            if "nif_oc" not in header or "identificador" not in header:
+                print(
+                    f"  Warning: {os.path.basename(csv_path)} lacks nif_oc/identificador columns; skipping file"
+                )
+                continue
+            ncols = len(header)
+            nif_idx = header.index("nif_oc")
+            convert = build_row_converter(header, LICITACION_COLUMNS)
             for r in reader:
-                nif = (r.get("nif_oc") or "").strip()
-                if nif != UAM_NIF:
-                    skipped_nif += 1
-                    continue  # keep only UAM rows
-                ident = r.get("identificador")
-                if ident in seen_ids:
-                    skipped_dups += 1
-                    continue  # keep first occurrence only to respect ER PK
-                seen_ids.add(ident)
-
-                # Extract text fields for embedding
-                objeto = (r.get("objeto_licitacion_o_lote") or "").strip()
-                descripcion = (
-                    r.get("descripcion_de_la_financiacion_europea") or ""
-                ).strip()
+                # Keep only UAM rows. Most rows are not UAM, so reject them
+                # before any other work: the substring test allocates nothing
+                # and only candidate rows pay for the stripped exact match.
+                if (
+                    len(r) <= nif_idx
+                    or UAM_NIF not in r[nif_idx]
+                    or r[nif_idx].strip() != UAM_NIF
+                ):
+                    if r:  # blank lines are not rows (DictReader skips them)
+                        skipped_nif += 1
+                    continue
+                if len(r) < ncols:
+                    r += [None] * (ncols - len(r))
+                row = convert(r)
+                # Text fields for embedding: objeto + descripcion
+                objeto = row[7]
+                descripcion = row[9]
                 combined_text = (
                     (objeto + "\n" + descripcion).strip()
                     if (objeto or descripcion)
                     else ""
                 )
 
-                rows.append(
-                    (
-                        to_int(ident),
-                        (r.get("nif_oc") or "").strip(),
-                        parse_ts(r.get("primera_publicacion")),
-                        to_decimal(
-                            r.get("presupuesto_base_sin_impuestos_licitacion_o_lote")
-                        ),
-                        to_decimal(
-                            r.get(
-                                "importe_adjudicacion_sin_impuestos_licitacion_o_lote"
-                            )
-                        ),
-                        (r.get("resultado_licitacion_o_lote") or "").strip(),
-                        (
-                            r.get("identificador_adjudicatario_de_la_licitacion_o_lote")
-                            or ""
-                        ).strip(),
-                        objeto,
-                        (r.get("link_licitacion") or "").strip(),
-                        descripcion,
-                    )
-                )
+                rows.append(row)
                 texts_for_embedding.append(combined_text)
-                kept += 1
 
         if rows:
             # Compute embeddings in batch if model is available
-            embeddings = []
+            embeddings = None
             if model is not None and texts_for_embedding:
                 print(
                     f"Computing embeddings for {len(texts_for_embedding)} LICITACION rows..."
@@ -639,48 +785,44 @@ def load_licitacion(conn, csv_files):
                     )
                 except Exception as e:
                     print(f"Warning: failed to compute embeddings: {e}")
-                    embeddings = []
+                    embeddings = None
 
             # Prepare rows with embeddings
-            rows_with_embeddings = []
-            for i, row in enumerate(rows):
-                if embeddings and i < len(embeddings):
-                    emb_literal = to_pgvector_literal(embeddings[i])
-                    rows_with_embeddings.append(row + (emb_literal,))
-                else:
-                    rows_with_embeddings.append(row + (None,))
-
-            # Insert rows into database
-            with conn.cursor() as cur:
-                extras.execute_values(
-                    cur,
-                    """
-                    INSERT INTO LICITACION (
-                        identificador, nif_oc, primera_publicacion,
-                        presupuesto_base_sin_impuestos_licitacion_o_lote,
-                        importe_adjudicacion_sin_impuestos_licitacion_o_lote,
-                        resultado_licitacion_o_lote,
-                        identificador_adjudicatario_de_la_licitacion_o_lote,
-                        objeto_licitacion_o_lote,
-                        link_licitacion,
-                        descripcion_de_la_financiacion_europea,
-                        embedding
-                    ) VALUES %s
-                    """,
-                    rows_with_embeddings,
-                )
+            if embeddings is not None:
+                rows_with_embeddings = [
+                    row + (emb,) for row, emb in zip(rows, embeddings)
+                ]
+            else:
+                rows_with_embeddings = [row + (None,) for row in rows]
+
+            # Insert rows into database; duplicates are skipped by the PK
+            inserted = extras.execute_values(
+                cur,
+                """
+                INSERT INTO LICITACION (
+                    identificador, nif_oc, primera_publicacion,
+                    presupuesto_base_sin_impuestos_licitacion_o_lote,
+                    importe_adjudicacion_sin_impuestos_licitacion_o_lote,
+                    resultado_licitacion_o_lote,
+                    identificador_adjudicatario_de_la_licitacion_o_lote,
+                    objeto_licitacion_o_lote,
+                    link_licitacion,
+                    descripcion_de_la_financiacion_europea,
+                    embedding
+                ) VALUES %s
+                ON CONFLICT (identificador) DO NOTHING
+                RETURNING identificador
+                """,
+                rows_with_embeddings,
+                template="(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s::vector)",
+                page_size=PAGE_SIZE,
+                fetch=True,
+            )
+            kept = len(inserted)
+            skipped_dups = len(rows) - kept
 
-            # Create index for efficient similarity search if embeddings were added
-            if embeddings:
-                print("Creating vector index for similarity search...")
-                try:
-                    with conn.cursor() as cur:
-                        cur.execute(
-                            "CREATE INDEX IF NOT EXISTS licitacion_embedding_idx ON LICITACION USING ivfflat (embedding vector_l2_ops) WITH (lists = 100);"
-                        )
-                    print("Vector index created successfully.")
-                except Exception as e:
-                    print(f"Warning: failed to create vector index: {e}")
+            if embeddings is not None:
+                has_embeddings = True
 
         total_kept += kept
         total_skipped_nif += skipped_nif
@@ -691,6 +833,30 @@ def load_licitacion(conn, csv_files):
     print(
         f"Total LICITACION: {total_kept} rows, skipped non-UAM {total_skipped_nif}, skipped dups {total_skipped_dups}"
     )
+    return has_embeddings
+
+
+def create_vector_index(cur):
+    """Build the HNSW index on LICITACION.embedding for similarity search.
+
+    Called once, after the last file and after SET LOGGED: building it per
+    file would insert later files into a live HNSW graph, and SET LOGGED
+    rewrites the table and rebuilds all of its indexes.
+    """
+    print("Creating vector index for similarity search...")
+    # Named like pgvector_ingest_and_query.py's per-opclass indexes, so running
+    # that script's default (float, l2) ingest afterwards reuses this index
+    # A failed CREATE INDEX must not abort the load's single transaction
+    cur.execute("SAVEPOINT vector_index")
+    try:
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS licitacion_embedding_vector_l2_ops_idx ON LICITACION USING hnsw (embedding vector_l2_ops) WITH (m = 16, ef_construction = 64);"
+        )
+        cur.execute("RELEASE SAVEPOINT vector_index")
+        print("Vector index created successfully.")
+    except Exception as e:
+        cur.execute("ROLLBACK TO SAVEPOINT vector_index")
+        print(f"Warning: failed to create vector index: {e}")
 
 
 def main():
@@ -709,6 +875,12 @@ def main():
         default="data/csv",
         help="Directory containing CSV files (default: data/csv)",
     )
+    parser.add_argument(
+        "--keep-unlogged",
+        action="store_true",
+        help="Leave tables UNLOGGED after the load (faster, but not crash-safe; "
+        "only for disposable databases)",
+    )
     args = parser.parse_args()
 
     # Resolve CSV directory path
@@ -736,21 +908,32 @@ def main():
 
     conn = connect_db(args)
     try:
+        # One cursor and one transaction for the whole load: committed once
         with conn.cursor() as cur:
             create_tables(cur)
+            # numpy arrays are sent as `vector` values (needs the extension)
+            register_vector(conn)
             seed_universidad(cur)
 
-        # Load data in correct FK order
-        if discovered["gastos"]:
-            load_gastos(conn, discovered["gastos"])
-        if discovered["ingresos"]:
-            load_ingresos(conn, discovered["ingresos"])
-        if discovered["convocatorias"]:
-            load_convocatoria(conn, discovered["convocatorias"])
-        if discovered["ayudas"]:
-            load_ayuda(conn, discovered["ayudas"])
-        if discovered["licitaciones"]:
-            load_licitacion(conn, discovered["licitaciones"])
+            # Load data in correct FK order
+            has_embeddings = False
+            if discovered["gastos"]:
+                load_gastos(cur, discovered["gastos"])
+            if discovered["ingresos"]:
+                load_ingresos(cur, discovered["ingresos"])
+            if discovered["convocatorias"]:
+                load_convocatoria(cur, discovered["convocatorias"])
+            if discovered["ayudas"]:
+                load_ayuda(cur, discovered["ayudas"])
+            if discovered["licitaciones"]:
+                has_embeddings = load_licitacion(cur, discovered["licitaciones"])
+
+            add_foreign_keys(cur)
+            if not args.keep_unlogged:
+                set_tables_logged(cur)
+            # Last: SET LOGGED rewrites LICITACION and would rebuild it again
+            if has_embeddings:
+                create_vector_index(cur)
 
         conn.commit()
         print("\n✅ DONE: All data loaded successfully.")
@@ -15,6 +15,7 @@ Usage (PowerShell):
 Notes:
  - The script supports a lightweight deterministic `dummy` embedding (fast) or
    `transformer` mode using `sentence-transformers` (install separately).
+ - Similarity search uses an HNSW index (requires pgvector >= 0.5.0).
  - The `LICITACION` table will contain: id (serial if no id supplied), source_id (optional original id), text, embedding (vector(dim)).
 """
 
@@ -22,51 +23,213 @@ from __future__ import annotations
 
 import argparse
 import csv
-import math
+import functools
+import hashlib
+import io
+import itertools
 import os
+import pickle
+import re
+import struct
 import sys
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Optional, Tuple
 
 try:
     import psycopg2
-    from psycopg2.extras import execute_values
+    import psycopg2.pool
 except Exception:
     print("Error: psycopg2 is required. Install with 'pip install psycopg2-binary'", file=sys.stderr)
     raise
 
+try:
+    from pgvector.psycopg2 import register_vector
+except Exception:
+    print("Error: pgvector is required. Install with 'pip install pgvector'", file=sys.stderr)
+    raise
+
 try:
     import numpy as np
 except Exception:
-    np = None
+    print("Error: numpy is required. Install with 'pip install numpy'", file=sys.stderr)
+    raise
+
+HAS_PYARROW = False
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+    HAS_PYARROW = True
+except Exception:
+    HAS_PYARROW = False
 
 HAS_TRANSFORMERS = False
 try:
+    import torch
     from sentence_transformers import SentenceTransformer
     HAS_TRANSFORMERS = True
 except Exception:
     HAS_TRANSFORMERS = False
 
 
-def dummy_embedding(text: str, dim: int = 128) -> List[float]:
-    vals = [ord(c) for c in text]
-    if not vals:
-        vals = [0]
-    vec = [float(vals[i % len(vals)]) for i in range(dim)]
-    norm = math.sqrt(sum(x * x for x in vec)) or 1.0
-    return [x / norm for x in vec]
+# --precision -> embedding column type. half stores FP16 (pgvector >= 0.7
+# halfvec); binary stores the sign bit of each dimension in a bit(dim) column
+# searched by Hamming distance.
+PRECISIONS = {
+    "float": "vector",
+    "half": "halfvec",
+    "binary": "bit",
+}
+PRECISION_HELP = "Embedding storage: float (vector), half (halfvec, pgvector >= 0.7) or binary (sign bits in bit(dim), Hamming distance)"
+
+# --metric -> (HNSW operator class suffix, distance operator). Embeddings are
+# unit-normalized, so all three rank alike; ip (<#>, negative inner product)
+# is the cheapest kernel. binary precision always uses Hamming distance.
+METRICS = {
+    "l2": ("l2_ops", "<->"),
+    "cosine": ("cosine_ops", "<=>"),
+    "ip": ("ip_ops", "<#>"),
+}
+METRIC_HELP = "Distance for the HNSW index and KNN search: l2 (<->), cosine (<=>) or ip (<#>, negative inner product); ignored for --precision binary"
+
+# File (inside --cache-dir) holding pickled query embeddings
+QUERY_CACHE_FILE = "query_embeddings.pkl"
+
+# Semantic result cache: file inside --cache-dir and max queries kept per
+# configuration (mode/model/dim/precision/metric/k)
+SEMANTIC_CACHE_FILE = "semantic_cache.pkl"
+SEMANTIC_CACHE_SIZE = 1000
+
+# CSV rows embedded and COPYed per ingest batch
+INGEST_BATCH_SIZE = 2048
+
+# Read buffer for ingest CSVs (the default 8 KiB means one read() per 8 KiB)
+CSV_READ_BUFFER = 1 << 20
+
+# Prepared statement names created on each open connection (they live as long
+# as the session, so a reused connection skips PREPARE)
+_PREPARED: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+# Lazily created pool of query connections (see _get_conn) and the pooled
+# connections that already have the pgvector adapter registered
+_POOL = None
+_VECTOR_REGISTERED: "weakref.WeakSet" = weakref.WeakSet()
+
+
+def dummy_embedding(text: str, dim: int = 128) -> "np.ndarray":
+    return dummy_embeddings_batch([text], dim)[0]
+
+
+def dummy_embeddings_batch(texts: List[str], dim: int = 128) -> "np.ndarray":
+    """Vectorized `dummy_embedding` for many texts.
+
+    Returns an (N, dim) float32 matrix: each text's code points are tiled to
+    `dim` values and L2-normalized (an empty text gives a zero vector).
+    """
+    mat = np.zeros((len(texts), dim), dtype=np.float32)
+    for i, text in enumerate(texts):
+        if text:
+            # UTF-32 code units are exactly the ord() values of the characters
+            mat[i] = np.resize(np.frombuffer(text.encode("utf-32-le"), dtype="<u4"), dim)
+    mat /= np.linalg.norm(mat, axis=1, keepdims=True).clip(min=1e-9)
+    return mat
+
+
+@functools.lru_cache(maxsize=4)
+def load_transformer(model_name: str) -> SentenceTransformer:
+    """Load a SentenceTransformer, moved to the GPU in half precision when CUDA is available.
+
+    Cached per model name, so repeated ingest/query calls in one process
+    reuse the loaded weights.
+    """
+    # let CPU inference use every available core
+    torch.set_num_threads(os.cpu_count() or 1)
+    model = SentenceTransformer(model_name)
+    if torch.cuda.is_available():
+        model = model.half().to("cuda")
+    return model
+
+
+def transformer_embeddings(model: SentenceTransformer, texts: List[str], pool=None) -> "np.ndarray":
+    # encode() sorts texts by length internally so each batch of 64 is padded
+    # to similar lengths; output is an (N, dim) float32 array of unit vectors.
+    # pool: a started model.start_multi_process_pool() to encode with
+    if pool is not None:
+        embeddings = model.encode_multi_process(texts, pool, batch_size=64, normalize_embeddings=True)
+    else:
+        embeddings = model.encode(
+            texts,
+            batch_size=64,
+            show_progress_bar=len(texts) > 1,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        )
+    # a half-precision CUDA model can hand back float16; keep float32
+    # (pgvector's `vector` element type) like the dummy embeddings
+    return np.asarray(embeddings, dtype=np.float32)
 
 
-def transformer_embeddings(model: SentenceTransformer, texts: List[str]) -> List[List[float]]:
-    arr = model.encode(texts, convert_to_numpy=False)
-    # model.encode may return list or numpy array; normalize to list of lists
-    return [list(a) for a in arr]
+# COPY binary format framing: signature + flags + header extension length,
+# the per-row field count used by ingest_csv, and the end-of-data trailer.
+COPY_BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+COPY_BINARY_TRAILER = struct.pack(">h", -1)
+_COPY_NULL = struct.pack(">i", -1)
 
 
-def to_pgvector_literal(vec: List[float]) -> str:
-    return "[" + ",".join(f"{float(x):.10f}" for x in vec) + "]"
+def copy_binary_field(data: Optional[bytes]) -> bytes:
+    """Frame one COPY binary field: int32 length + data (None becomes NULL)."""
+    if data is None:
+        return _COPY_NULL
+    return struct.pack(">i", len(data)) + data
 
 
-def connect_db():
+def vector_to_binary(vec, precision: str = "float") -> bytes:
+    """Encode an embedding in the COPY binary format of its column type.
+
+    float  -> pgvector `vector`: int16 dim, int16 unused, big-endian float4s
+    half   -> pgvector `halfvec`: same header, big-endian float2s
+    binary -> Postgres `bit`: int32 bit count, sign bits packed MSB first
+    """
+    n = len(vec)
+    if precision == "binary":
+        return struct.pack(">i", n) + np.packbits(np.asarray(vec) > 0).tobytes()
+    arr = np.asarray(vec, dtype=">f2" if precision == "half" else ">f4")
+    return struct.pack(">HH", n, 0) + arr.tobytes()
+
+
+def to_bit_literal(vec) -> str:
+    """Sign-quantize an embedding to a Postgres bit string literal ('0101...')."""
+    return "".join("1" if x > 0 else "0" for x in vec)
+
+
+class IterStream(io.RawIOBase):
+    """Read-only binary file object over an iterable of byte chunks.
+
+    Lets `cursor.copy_expert` pull COPY data lazily from a generator instead
+    of a fully materialized buffer.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buf = bytearray()
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buf) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buf += chunk
+        if size < 0:
+            size = len(self._buf)
+        data = bytes(self._buf[:size])
+        del self._buf[:size]
+        return data
+
+
+def db_params() -> dict:
     # Resolve connection parameters with the following precedence:
     # 1) Docker-compose POSTGRES_* (used when running inside containers)
     # 2) PG* environment vars (common on developer machines)
@@ -85,14 +248,17 @@ def connect_db():
     password = os.getenv("POSTGRES_PASSWORD") or os.getenv("PGPASSWORD") or "mypassword"
     dbname = os.getenv("POSTGRES_DB") or os.getenv("PGDATABASE") or "mydb"
 
-    params = {
+    return {
         "host": host,
         "port": port,
         "user": user,
         "password": password,
         "dbname": dbname,
     }
-    conn = psycopg2.connect(**params)
+
+
+def connect_db():
+    conn = psycopg2.connect(**db_params())
     # Ensure DB client encoding is UTF8 for proper text round-trip
     try:
         conn.set_client_encoding("UTF8")
@@ -101,10 +267,36 @@ def connect_db():
     return conn
 
 
-def ensure_table(cur, dim: int):
+def _get_conn():
+    """Borrow a connection from the module's query pool (return it with _POOL.putconn).
+
+    Connections stay open between query_documents calls, so a long-lived
+    process pays the connect/auth handshake once per pooled connection.
+    """
+    global _POOL
+    if _POOL is None:
+        _POOL = psycopg2.pool.ThreadedConnectionPool(1, 8, client_encoding="UTF8", **db_params())
+    conn = _POOL.getconn()
+    if conn not in _VECTOR_REGISTERED:
+        # numpy query vectors are adapted by pgvector, no literal formatting
+        register_vector(conn)
+        _VECTOR_REGISTERED.add(conn)
+    return conn
+
+
+def distance_ops(precision: str, metric: str) -> Tuple[str, str]:
+    """Return the (HNSW operator class, distance operator) for a precision and metric."""
+    if precision == "binary":
+        return "bit_hamming_ops", "<~>"
+    suffix, op = METRICS[metric]
+    return f"{PRECISIONS[precision]}_{suffix}", op
+
+
+def ensure_table(cur, dim: int, precision: str = "float"):
     # Ensure pgvector extension exists and LICITACION has an embedding column.
     # Create a minimal LICITACION table compatible with the project's loader
     # (`scripts/load_filtered_csvs.py`) if it doesn't exist.
+    column_type = f"{PRECISIONS[precision]}({dim})"
     cur.execute("CREATE EXTENSION IF NOT EXISTS vector;")
     cur.execute("SELECT to_regclass('public.LICITACION')")
     exists = cur.fetchone()[0]
@@ -122,157 +314,399 @@ def ensure_table(cur, dim: int):
                 objeto_licitacion_o_lote TEXT,
                 link_licitacion TEXT,
                 descripcion_de_la_financiacion_europea TEXT,
-                embedding vector({dim})
+                embedding {column_type}
             );
             """
         )
         return
 
-    # If table exists, ensure embedding column exists and has the expected dim
+    # If table exists, ensure embedding column exists and has the expected
+    # type and dim (e.g. 'vector(384)', 'halfvec(384)' or 'bit(384)')
     cur.execute(
-        "SELECT attname, atttypmod FROM pg_attribute WHERE attrelid = 'public.LICITACION'::regclass AND attname = 'embedding';"
+        "SELECT format_type(atttypid, atttypmod) FROM pg_attribute WHERE attrelid = 'public.LICITACION'::regclass AND attname = 'embedding' AND NOT attisdropped;"
     )
     info = cur.fetchone()
     if not info:
-        cur.execute(f"ALTER TABLE LICITACION ADD COLUMN embedding vector({dim});")
+        cur.execute(f"ALTER TABLE LICITACION ADD COLUMN embedding {column_type};")
         return
 
-    _, atttypmod = info
-    try:
-        existing_dim = atttypmod - 4 if atttypmod is not None else None
-    except Exception:
-        existing_dim = None
-    if existing_dim and existing_dim != dim:
+    existing_type = info[0]
+    if existing_type != column_type:
         print(
-            f"Warning: existing LICITACION.embedding dim={existing_dim} differs from required dim={dim}. Replacing column (will DROP existing embedding column)."
+            f"Warning: existing LICITACION.embedding type={existing_type} differs from required type={column_type}. Replacing column (will DROP existing embedding column)."
         )
         cur.execute("ALTER TABLE LICITACION DROP COLUMN embedding;")
-        cur.execute(f"ALTER TABLE LICITACION ADD COLUMN embedding vector({dim});")
+        cur.execute(f"ALTER TABLE LICITACION ADD COLUMN embedding {column_type};")
 
 
-def ingest_csv(csv_path: str, text_col: Optional[str], id_col: Optional[str], lote_col: Optional[str], mode: str, dim: int, **kwargs):
-    # read CSV and collect texts
-    texts_for_batch: List[str] = []
-    source_ids: List[Optional[str]] = []
-    lote_vals: List[Optional[str]] = []
+def chunked(iterable, size: int):
+    """Yield lists of up to `size` consecutive items from iterable."""
+    it = iter(iterable)
+    while True:
+        batch = list(itertools.islice(it, size))
+        if not batch:
+            return
+        yield batch
 
-    with open(csv_path, newline='', encoding='utf-8') as fh:
-        reader = csv.DictReader(fh)
-        if not reader.fieldnames or text_col not in reader.fieldnames:
-            # If user didn't supply a text_col, require the two LICITACION text
-            # columns to exist and combine them.
-            if not text_col:
-                needed = ['objeto_licitacion_o_lote', 'descripcion_de_la_financiacion_europea']
-                for n in needed:
-                    if n not in reader.fieldnames:
-                        raise ValueError(f"Required column '{n}' not found in CSV; available: {reader.fieldnames}")
-            else:
-                raise ValueError(f"text column '{text_col}' not found in CSV; available: {reader.fieldnames}")
-        for row in reader:
-            # Build text: either a single column (text_col) or the combination of
-            # objeto_licitacion_o_lote + descripcion_de_la_financiacion_europea
-            if text_col:
-                txt = row.get(text_col, "")
+
+# Integer ids in the syntax int() accepts: optional sign, digits with single
+# underscores between them, surrounding whitespace
+_INT_RE = re.compile(r"\s*[+-]?\d+(?:_\d+)*\s*")
+
+
+def clean_ident(x):
+    # regex check instead of try/int(): blank or non-numeric ids are common
+    # and raising/catching ValueError per row is comparatively slow
+    return int(x) if x and _INT_RE.fullmatch(x) else None
+
+
+def copy_batch(cur, source_ids: List[Optional[str]], texts: List[str], embeddings, precision: str = "float"):
+    """COPY one batch of (identificador, objeto, descripcion, embedding) rows into LICITACION."""
+    row_header = struct.pack(">h", 4)  # fields per COPY row
+
+    def copy_rows():
+        yield COPY_BINARY_HEADER
+        for sid, txt, emb in zip(source_ids, texts, embeddings):
+            ident = clean_ident(sid)
+            # split combined text back into objeto and descripcion if possible
+            if "\n" in txt:
+                objeto, descripcion = txt.split("\n", 1)
+                objeto = objeto.strip()
+                descripcion = descripcion.strip()
             else:
-                a = (row.get('objeto_licitacion_o_lote') or "").strip()
-                b = (row.get('descripcion_de_la_financiacion_europea') or "").strip()
-                txt = (a + "\n" + b).strip() if (a or b) else ""
-            sid = row[id_col] if id_col and id_col in row else None
-            texts_for_batch.append(txt)
-            source_ids.append(sid)
-
-    if not texts_for_batch:
-        print("No rows found in CSV; nothing to ingest.")
+                objeto = txt
+                descripcion = None
+            yield b"".join((
+                row_header,
+                copy_binary_field(None if ident is None else struct.pack(">q", ident)),
+                copy_binary_field(objeto.encode("utf-8")),
+                copy_binary_field(None if descripcion is None else descripcion.encode("utf-8")),
+                copy_binary_field(vector_to_binary(emb, precision)),
+            ))
+        yield COPY_BINARY_TRAILER
+
+    # stream rows with binary COPY: vectors are sent packed, so no per-element
+    # text formatting (client side) or parsing (server side)
+    cur.copy_expert(
+        "COPY LICITACION (identificador, objeto_licitacion_o_lote, descripcion_de_la_financiacion_europea, embedding) FROM STDIN WITH (FORMAT binary)",
+        IterStream(copy_rows()),
+    )
+
+
+LICITACION_TEXT_COLS = ['objeto_licitacion_o_lote', 'descripcion_de_la_financiacion_europea']
+
+
+def check_text_columns(fieldnames: Optional[List[str]], text_col: Optional[str]):
+    if not fieldnames or text_col not in fieldnames:
+        # If user didn't supply a text_col, require the two LICITACION text
+        # columns to exist and combine them.
+        if not text_col:
+            for n in LICITACION_TEXT_COLS:
+                if n not in (fieldnames or []):
+                    raise ValueError(f"Required column '{n}' not found in CSV; available: {fieldnames}")
+        else:
+            raise ValueError(f"text column '{text_col}' not found in CSV; available: {fieldnames}")
+
+
+def combine_texts(objeto: Optional[str], descripcion: Optional[str]) -> str:
+    # objeto_licitacion_o_lote + descripcion_de_la_financiacion_europea
+    a = (objeto or "").strip()
+    b = (descripcion or "").strip()
+    return (a + "\n" + b).strip() if (a or b) else ""
+
+
+def read_text_batches(csv_path: str, text_col: Optional[str], id_col: Optional[str], batch_size: int):
+    """Yield (source_ids, texts) lists for up to `batch_size` CSV rows at a time.
+
+    Each text is `text_col` or, without it, the combination of the two
+    LICITACION text columns. Parsing uses pyarrow's multithreaded C reader
+    when installed, and csv.DictReader otherwise.
+    """
+    if HAS_PYARROW:
+        yield from _read_text_batches_arrow(csv_path, text_col, id_col, batch_size)
         return
+    with open(csv_path, newline='', encoding='utf-8', buffering=CSV_READ_BUFFER) as fh:
+        reader = csv.DictReader(fh)
+        check_text_columns(reader.fieldnames, text_col)
+        for batch in chunked(reader, batch_size):
+            yield _dict_rows_batch(batch, text_col, id_col)
 
-    # compute embeddings first so we know the correct dimension
+
+def _dict_rows_batch(rows: List[dict], text_col: Optional[str], id_col: Optional[str]):
+    """(source_ids, texts) for a list of csv.DictReader-style rows."""
+    if text_col:
+        # short rows are padded with None; embed those as ""
+        texts = [row.get(text_col) or "" for row in rows]
+    else:
+        texts = [combine_texts(row.get(LICITACION_TEXT_COLS[0]), row.get(LICITACION_TEXT_COLS[1])) for row in rows]
+    source_ids = [row[id_col] if id_col and id_col in row else None for row in rows]
+    return source_ids, texts
+
+
+def _read_text_batches_arrow(csv_path: str, text_col: Optional[str], id_col: Optional[str], batch_size: int):
+    # The header is read with the csv module so the columns can be validated
+    # and only the needed ones are parsed (as strings) by pyarrow
+    with open(csv_path, newline='', encoding='utf-8') as fh:
+        fieldnames = next(csv.reader(fh), None)
+    check_text_columns(fieldnames, text_col)
+    columns = [text_col] if text_col else list(LICITACION_TEXT_COLS)
+    if id_col and id_col in fieldnames:
+        columns.append(id_col)
+
+    # pyarrow can only skip or reject rows whose column count differs from
+    # the header; csv.DictReader pads short rows with None (and drops extra
+    # fields). Skipped rows are kept and yielded last, parsed like DictReader.
+    ragged: List[str] = []
+
+    def keep_ragged(row) -> str:
+        ragged.append(row.text)
+        return "skip"
+
+    reader = pa_csv.open_csv(
+        csv_path,
+        read_options=pa_csv.ReadOptions(block_size=32 << 20),
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True, invalid_row_handler=keep_ragged),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=columns,
+            column_types={c: pa.string() for c in columns},
+        ),
+    )
+    for record_batch in reader:
+        for offset in range(0, record_batch.num_rows, batch_size):
+            part = record_batch.slice(offset, batch_size)
+            cols = {name: part.column(name).to_pylist() for name in part.schema.names}
+            if text_col:
+                texts = [t or "" for t in cols[text_col]]
+            else:
+                texts = [combine_texts(a, b) for a, b in zip(cols[LICITACION_TEXT_COLS[0]], cols[LICITACION_TEXT_COLS[1]])]
+            source_ids = cols[id_col] if id_col and id_col in cols else [None] * part.num_rows
+            yield source_ids, texts
+
+    if ragged:
+        rows = [
+            dict(itertools.zip_longest(fieldnames, values[:len(fieldnames)]))
+            for text in ragged
+            for values in csv.reader(io.StringIO(text))
+        ]
+        for batch in chunked(rows, batch_size):
+            yield _dict_rows_batch(batch, text_col, id_col)
+
+
+def ingest_csv(csv_path: str, text_col: Optional[str], id_col: Optional[str], lote_col: Optional[str], mode: str, dim: int, precision: str = "float", batch_size: int = INGEST_BATCH_SIZE, metric: str = "l2", multi_process: bool = False, **kwargs):
+    # Rows are streamed: each batch of `batch_size` CSV rows is embedded and
+    # COPYed before the next one is read, so memory stays O(batch_size).
+    model = None
     if mode == 'transformer':
         if not HAS_TRANSFORMERS:
             print("sentence-transformers not installed. Install with 'pip install sentence-transformers' or use --mode dummy", file=sys.stderr)
             sys.exit(1)
         model_name = kwargs.get('model_name') if kwargs and 'model_name' in kwargs else 'paraphrase-multilingual-MiniLM-L12-v2'
-        model = SentenceTransformer(model_name)
-        embeddings = transformer_embeddings(model, texts_for_batch)
-        actual_dim = len(embeddings[0])
-    else:
-        embeddings = [dummy_embedding(t, dim) for t in texts_for_batch]
-        actual_dim = len(embeddings[0])
-
-    # connect to db and ensure table uses actual_dim
-    conn = connect_db()
-    conn.autocommit = True
-    cur = conn.cursor()
-    # ensure LICITACION has embedding column with correct dim
-    ensure_table(cur, actual_dim)
-
-    # prepare tuples for bulk insert into LICITACION.
-    # We'll insert: identificador, objeto_licitacion_o_lote,
-    # descripcion_de_la_financiacion_europea, embedding
-    def clean_ident(x):
-        if x is None or x == '':
-            return None
+        model = load_transformer(model_name)
+
+    # Multi-process encoding pool (--multi-process), started once for the
+    # whole ingest so each worker loads the model once (not once per batch)
+    pool = None
+    if model is not None and multi_process:
+        # one worker per CUDA device, or several CPU workers without a GPU
+        pool = model.start_multi_process_pool()
+
+    def embed(texts: List[str]):
+        if model is not None:
+            return transformer_embeddings(model, texts, pool)
+        return dummy_embeddings_batch(texts, dim)
+
+    conn = None
+    cur = None
+    total = 0
+
+    def write(source_ids, texts, future):
+        nonlocal conn, cur, total
+        embeddings = future.result()
+        if conn is None:
+            # the first batch tells the actual embedding dim: connect and
+            # ensure LICITACION has an embedding column with that dim
+            conn = connect_db()
+            cur = conn.cursor()
+            ensure_table(cur, len(embeddings[0]), precision)
+        copy_batch(cur, source_ids, texts, embeddings, precision)
+        total += len(texts)
+        print(f"Copied {total} documents...")
+
+    # The whole ingest is one transaction, committed at the end: an error in
+    # any batch leaves LICITACION as it was (closing without commit rolls back)
+    try:
+        with ThreadPoolExecutor(max_workers=1) as encoder:
+            # Pipeline: batch N+1 is encoded in the worker thread while batch N
+            # is COPYed from this thread (the only one using the DB connection).
+            pending = None
+            for source_ids, texts in read_text_batches(csv_path, text_col, id_col, batch_size):
+                future = encoder.submit(embed, texts)
+                if pending is not None:
+                    write(*pending)
+                pending = (source_ids, texts, future)
+            if pending is not None:
+                write(*pending)
+
+        if conn is None:
+            print("No rows found in CSV; nothing to ingest.")
+            return
+
+        # try create an index; named after its operator class so each metric
+        # gets its own index (a query only uses the one matching its operator).
+        # The savepoint keeps a failed build from aborting the transaction.
+        opclass = distance_ops(precision, metric)[0]
+        cur.execute("SAVEPOINT embedding_index")
         try:
-            return int(x)
-        except Exception:
-            return None
-
-    tuples = []
-    for sid, txt, emb in zip(source_ids, texts_for_batch, embeddings):
-        ident = clean_ident(sid)
-        # split combined text back into objeto and descripcion if possible
-        if "\n" in txt:
-            objeto, descripcion = txt.split("\n", 1)
-            objeto = objeto.strip()
-            descripcion = descripcion.strip()
-        else:
-            objeto = txt
-            descripcion = None
-        tuples.append((ident, objeto, descripcion, to_pgvector_literal(emb)))
-
-    print(f"Inserting {len(tuples)} documents into DB...")
-    # use execute_values for fast bulk insert; pass the literal vector string as text (psycopg2 will quote)
-    execute_values(
-        cur,
-        "INSERT INTO LICITACION (identificador, objeto_licitacion_o_lote, descripcion_de_la_financiacion_europea, embedding) VALUES %s;",
-        tuples,
-    )
-
-    # try create an index
+            cur.execute(
+                f"CREATE INDEX IF NOT EXISTS licitacion_embedding_{opclass}_idx ON LICITACION USING hnsw (embedding {opclass}) WITH (m = 16, ef_construction = 64);"
+            )
+            cur.execute("RELEASE SAVEPOINT embedding_index")
+        except Exception as e:
+            cur.execute("ROLLBACK TO SAVEPOINT embedding_index")
+            print("Warning: index creation failed:", e)
+
+        conn.commit()
+        cur.close()
+    finally:
+        if pool is not None:
+            model.stop_multi_process_pool(pool)
+        if conn is not None:
+            conn.close()
+    print(f"Ingest complete: {total} documents committed.")
+
+
+def load_query_cache(cache_dir: str, filename: str = QUERY_CACHE_FILE) -> dict:
+    """Load a dict pickled in cache_dir/filename ({} if absent or unreadable)."""
     try:
-        cur.execute(
-            "CREATE INDEX IF NOT EXISTS licitacion_embedding_idx ON LICITACION USING ivfflat (embedding vector_l2_ops) WITH (lists = 100);"
-        )
-    except Exception as e:
-        print("Warning: index creation failed:", e)
+        with open(os.path.join(cache_dir, filename), "rb") as fh:
+            return pickle.load(fh)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return {}
 
-    cur.close()
-    conn.close()
-    print("Ingest complete.")
 
+def save_query_cache(cache_dir: str, cache: dict, filename: str = QUERY_CACHE_FILE):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, filename)
+    # write then rename so an interrupted run never leaves a truncated cache
+    with open(path + ".tmp", "wb") as fh:
+        pickle.dump(cache, fh, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + ".tmp", path)
+
+
+def embed_query(query: str, mode: str, dim: int, model_name: Optional[str] = None, cache_dir: Optional[str] = None):
+    """Compute the embedding of a query string.
+
+    With cache_dir, embeddings are kept in a pickled dict keyed by a hash of
+    (mode, model, dim, query), so a repeated query skips encoding entirely.
+    """
+    if mode == 'transformer':
+        model_name = model_name or 'paraphrase-multilingual-MiniLM-L12-v2'
+    cache = key = None
+    if cache_dir:
+        cache = load_query_cache(cache_dir)
+        key = hashlib.sha256(f"{mode}\0{model_name}\0{dim}\0{query}".encode("utf-8")).hexdigest()
+        if key in cache:
+            return cache[key]
 
-def query_documents(query: str, mode: str, dim: int, k: int = 5, model_name: Optional[str] = None):
-    # compute query embedding
     if mode == 'transformer':
         if not HAS_TRANSFORMERS:
             print("sentence-transformers not installed. Install with 'pip install sentence-transformers' or use --mode dummy", file=sys.stderr)
             sys.exit(1)
-        model_name = model_name or 'paraphrase-multilingual-MiniLM-L12-v2'
-        model = SentenceTransformer(model_name)
+        model = load_transformer(model_name)
         qemb = transformer_embeddings(model, [query])[0]
     else:
         qemb = dummy_embedding(query, dim)
 
-    qlit = to_pgvector_literal(qemb)
+    if cache is not None:
+        cache[key] = qemb
+        save_query_cache(cache_dir, cache)
+    return qemb
+
+
+def knn_query(cur, qvec, k: int, precision: str, dim: int, metric: str = "l2"):
+    """Return the k LICITACION rows nearest to the query vector.
+
+    The query runs as a server-side prepared statement, planned once per
+    session and (precision, metric, dim), using the pgvector distance
+    operator of the metric (<-> L2, <=> cosine, <#> inner product, <~>
+    Hamming for bit).
+    """
+    column_type = PRECISIONS[precision]
+    op = distance_ops(precision, metric)[1]
+    name = f"licitacion_knn_{precision}_{metric}_{dim}"
+    prepared = _PREPARED.setdefault(cur.connection, set())
+    if name not in prepared:
+        cur.execute(
+            f"PREPARE {name} (text, int) AS SELECT identificador, nif_oc, objeto_licitacion_o_lote, descripcion_de_la_financiacion_europea, embedding {op} $1::{column_type}({dim}) AS distance FROM LICITACION ORDER BY distance LIMIT $2;"
+        )
+        prepared.add(name)
+    cur.execute(f"EXECUTE {name} (%s, %s);", (qvec, k))
+    return cur.fetchall()
+
+
+def semantic_cache_lookup(cache_dir: str, config: str, qemb, threshold: float):
+    """Return cached result rows of a previous query whose embedding has cosine
+    similarity >= threshold with qemb (same config), or None on a miss."""
+    entry = load_query_cache(cache_dir, SEMANTIC_CACHE_FILE).get(config)
+    if not entry:
+        return None
+    q = np.asarray(qemb, dtype=np.float32)
+    q = q / max(float(np.linalg.norm(q)), 1e-9)
+    # cached embeddings are stored unit-normalized: cosine is a single matvec
+    scores = entry["embs"] @ q
+    best = int(np.argmax(scores))
+    if scores[best] < threshold:
+        return None
+    return entry["results"][best]
+
+
+def semantic_cache_store(cache_dir: str, config: str, qemb, rows):
+    """Add a query embedding and its result rows to the semantic cache."""
+    cache = load_query_cache(cache_dir, SEMANTIC_CACHE_FILE)
+    q = np.asarray(qemb, dtype=np.float32)
+    q = q / max(float(np.linalg.norm(q)), 1e-9)
+    entry = cache.get(config) or {"embs": np.empty((0, len(q)), dtype=np.float32), "results": []}
+    # keep only the most recent SEMANTIC_CACHE_SIZE queries
+    entry["embs"] = np.vstack([entry["embs"], q[None, :]])[-SEMANTIC_CACHE_SIZE:]
+    entry["results"] = (entry["results"] + [rows])[-SEMANTIC_CACHE_SIZE:]
+    cache[config] = entry
+    save_query_cache(cache_dir, cache, SEMANTIC_CACHE_FILE)
+
+
+def query_documents(query: str, mode: str, dim: int, k: int = 5, model_name: Optional[str] = None, ef_search: int = 40, precision: str = "float", cache_dir: Optional[str] = None, semantic_threshold: Optional[float] = None, metric: str = "l2"):
+    # compute query embedding
+    qemb = embed_query(query, mode, dim, model_name, cache_dir)
+
+    # Semantic cache: a near-identical earlier query (cosine >= threshold) with
+    # the same settings returns its stored rows without touching the DB
+    rows = None
+    use_semantic_cache = bool(cache_dir) and semantic_threshold is not None
+    if use_semantic_cache:
+        config = f"{mode}|{model_name}|{dim}|{precision}|{metric}|{k}"
+        rows = semantic_cache_lookup(cache_dir, config, qemb, semantic_threshold)
+        if rows is not None:
+            print("(results served from semantic cache)")
+
+    if rows is None:
+        conn = _get_conn()
+        try:
+            cur = conn.cursor()
+            qvec = to_bit_literal(qemb) if precision == "binary" else np.asarray(qemb, dtype=np.float32)
+
+            # HNSW candidate list size for this query (recall/speed trade-off);
+            # SET LOCAL only lasts for the current transaction
+            cur.execute("SET LOCAL hnsw.ef_search = %s", (ef_search,))
 
-    conn = connect_db()
-    cur = conn.cursor()
+            rows = knn_query(cur, qvec, k, precision, len(qemb), metric)
 
-    # Run similarity query using pgvector <-> operator against LICITACION
-    cur.execute(
-        "SELECT identificador, nif_oc, objeto_licitacion_o_lote, descripcion_de_la_financiacion_europea, embedding <-> %s AS distance FROM LICITACION ORDER BY distance LIMIT %s;",
-        (qlit, k),
-    )
-    rows = cur.fetchall()
+            cur.close()
+        finally:
+            # putconn rolls back the open transaction (and with it the SET
+            # LOCAL); prepared statements outlive it for the next query
+            _POOL.putconn(conn)
+
+        if use_semantic_cache:
+            semantic_cache_store(cache_dir, config, qemb, rows)
 
     print(f"Top {k} LICITACION rows for query: {query!r}")
     for identificador, nif_oc, objeto, descripcion, dist in rows:
@@ -281,9 +715,6 @@ def query_documents(query: str, mode: str, dim: int, k: int = 5, model_name: Opt
             text_preview += "\n" + descripcion
         print(f"identificador={identificador} nif_oc={nif_oc} distance={dist:.6f}\n{text_preview}\n---")
 
-    cur.close()
-    conn.close()
-
 
 def main():
     parser = argparse.ArgumentParser(description='Ingest CSV and query documents using pgvector')
@@ -297,6 +728,10 @@ def main():
     p_ingest.add_argument('--mode', choices=['dummy', 'transformer'], default='dummy')
     p_ingest.add_argument('--dim', type=int, default=128, help='Embedding dim (dummy mode)')
     p_ingest.add_argument('--model', dest='model_name', help='SentenceTransformer model name to use when --mode transformer (default: paraphrase-multilingual-MiniLM-L12-v2)')
+    p_ingest.add_argument('--batch-size', type=int, default=INGEST_BATCH_SIZE, help=f'CSV rows embedded and inserted per batch (default: {INGEST_BATCH_SIZE})')
+    p_ingest.add_argument('--precision', choices=sorted(PRECISIONS), default='float', help=PRECISION_HELP)
+    p_ingest.add_argument('--metric', choices=sorted(METRICS), default='l2', help=METRIC_HELP)
+    p_ingest.add_argument('--multi-process', action='store_true', help='Encode with a sentence-transformers process pool (one worker per CUDA device, or several CPU workers) kept for the whole ingest; transformer mode only')
 
     p_query = sub.add_parser('query')
     p_query.add_argument('--q', required=True, help='Query text')
@@ -304,12 +739,19 @@ def main():
     p_query.add_argument('--mode', choices=['dummy', 'transformer'], default='dummy')
     p_query.add_argument('--dim', type=int, default=128, help='Embedding dim (dummy mode)')
     p_query.add_argument('--model', dest='model_name', help='SentenceTransformer model name to use when --mode transformer (default: paraphrase-multilingual-MiniLM-L12-v2)')
+    p_query.add_argument('--precision', choices=sorted(PRECISIONS), default='float', help=PRECISION_HELP)
+    p_query.add_argument('--metric', choices=sorted(METRICS), default='l2', help=METRIC_HELP)
+    p_query.add_argument('--ef-search', type=int, default=40, help='HNSW hnsw.ef_search for the query (higher = better recall, slower)')
+    p_query.add_argument('--cache-dir', help='Directory where query embeddings are cached between runs (disabled by default)')
+    p_query.add_argument('--semantic-cache', type=float, metavar='THRESHOLD', help='Also cache results in --cache-dir and reuse them for queries with cosine similarity >= THRESHOLD (e.g. 0.95) to an earlier one')
 
     args = parser.parse_args()
+    if getattr(args, 'semantic_cache', None) is not None and not args.cache_dir:
+        parser.error('--semantic-cache requires --cache-dir')
     if args.cmd == 'ingest':
-        ingest_csv(args.csv, args.text_col, args.id_col, getattr(args, 'lote_col', None), args.mode, args.dim)
+        ingest_csv(args.csv, args.text_col, args.id_col, getattr(args, 'lote_col', None), args.mode, args.dim, args.precision, args.batch_size, args.metric, args.multi_process)
     elif args.cmd == 'query':
-        query_documents(args.q, args.mode, args.dim, args.k, getattr(args, 'model_name', None))
+        query_documents(args.q, args.mode, args.dim, args.k, getattr(args, 'model_name', None), args.ef_search, args.precision, args.cache_dir, args.semantic_cache, args.metric)
     else:
         parser.print_help()
 
@@ -0,0 +1,38 @@
+"""Tests de `csv_open_reader` (scripts/load_filtered_csvs.py)."""
+
+import builtins
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+import load_filtered_csvs  # noqa: E402
+
+
+class CsvOpenReaderTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.csv_path = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        self.addCleanup(os.remove, self.csv_path)
+        with open(self.csv_path, "w", newline="", encoding="utf-8") as f:
+            f.write("a,b\n1,ñ\n")
+
+    def test_opens_csv_with_large_buffer(self):
+        with mock.patch("builtins.open", wraps=builtins.open) as mock_open:
+            with load_filtered_csvs.csv_open_reader(self.csv_path) as reader:
+                rows = list(reader)
+
+        self.assertEqual(rows, [{"a": "1", "b": "ñ"}])
+        # la primera apertura es la de detect_encoding (binaria, una muestra)
+        text_opens = [
+            c for c in mock_open.call_args_list if c.args[:2] == (self.csv_path, "r")
+        ]
+        self.assertEqual(len(text_opens), 1)
+        self.assertGreaterEqual(text_opens[0].kwargs.get("buffering", -1), 1 << 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
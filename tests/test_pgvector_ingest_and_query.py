@@ -0,0 +1,48 @@
+"""Tests de `ingest_csv` (scripts/pgvector_ingest_and_query.py).
+
+La base de datos se sustituye por mocks: solo se comprueba cómo se lee el CSV.
+"""
+
+import builtins
+import csv
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+import pgvector_ingest_and_query as ingest  # noqa: E402
+
+
+class IngestCsvBufferingTest(unittest.TestCase):
+    def setUp(self):
+        fd, self.csv_path = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        self.addCleanup(os.remove, self.csv_path)
+        with open(self.csv_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["id", "texto"])
+            for i in range(5):
+                writer.writerow([i, f"texto {i}"])
+
+    def test_dictreader_path_opens_csv_with_large_buffer(self):
+        with mock.patch.object(ingest, "HAS_PYARROW", False), mock.patch.object(
+            ingest, "connect_db", mock.MagicMock()
+        ), mock.patch.object(ingest, "ensure_table"), mock.patch(
+            "builtins.open", wraps=builtins.open
+        ) as mock_open:
+            ingest.ingest_csv(self.csv_path, "texto", "id", None, "dummy", 16)
+
+        buffers = [
+            c.kwargs.get("buffering", -1)
+            for c in mock_open.call_args_list
+            if c.args and c.args[0] == self.csv_path
+        ]
+        self.assertTrue(buffers, "el CSV no se abrió")
+        self.assertTrue(all(b >= 1 << 20 for b in buffers), buffers)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+"""Tests de `_split_ttl` (upload_to_graphdb/upload_script.py).
+
+Cada parte debe ser Turtle válido por sí misma y la unión de las partes debe
+dar exactamente los mismos triples que el archivo completo.
+"""
+
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "upload_to_graphdb"))
+
+import upload_script  # noqa: E402
+
+try:
+    import rdflib
+except ImportError:
+    rdflib = None
+
+
+def split(ttl, part_size=1, prefix=b""):
+    return list(upload_script._split_ttl(io.BytesIO(ttl), prefix, part_size))
+
+
+@unittest.skipUnless(rdflib, "rdflib no está instalado")
+class SplitTtlParseTest(unittest.TestCase):
+    def assert_same_triples(self, ttl, part_size=1, prefix=b""):
+        whole = rdflib.Graph().parse(data=prefix + ttl, format="turtle")
+        parts = split(ttl, part_size, prefix)
+        self.assertGreater(len(parts), 1)
+        merged = set()
+        for part in parts:
+            merged |= set(rdflib.Graph().parse(data=part, format="turtle"))
+        self.assertEqual(merged, set(whole))
+        return parts
+
+    def test_prefix_redefined_mid_file(self):
+        ttl = (
+            b"@prefix ex: <http://a/> .\n\n"
+            b"ex:s1 ex:p ex:o .\n\n"
+            b"@prefix ex: <http://b/> .\n\n"
+            b"ex:s2 ex:p ex:o .\n\n"
+            b"ex:s3 ex:p ex:o .\n"
+        )
+        self.assert_same_triples(ttl)
+
+    def test_new_prefix_mid_file(self):
+        ttl = (
+            b"@prefix ex: <http://a/> .\n\n"
+            b"ex:s1 ex:p ex:o .\n\n"
+            b"PREFIX y: <http://y/>\n\n"
+            b"y:s2 ex:p ex:o .\n\n"
+            b"y:s3 ex:p ex:o .\n"
+        )
+        self.assert_same_triples(ttl)
+
+    def test_base_is_repeated_in_every_part(self):
+        ttl = b"<s1> <p> <o> .\n\n<s2> <p> <o> .\n"
+        self.assert_same_triples(ttl, prefix=b"@base <http://base/> .\n")
+
+    def test_long_literals_are_not_cut(self):
+        ttl = (
+            b"@prefix ex: <http://a/> .\n\n"
+            b'ex:s1 ex:p """uno.\n\ndos.\n\n""" .\n\n'
+            b"ex:s2 ex:p '''tres.\n\ncuatro.\n\n''' .\n\n"
+            b"ex:s3 ex:p \"\"\"a\"\"\", '''b''' .\n"
+        )
+        parts = self.assert_same_triples(ttl)
+        # cabecera + una parte por sujeto
+        self.assertEqual(len(parts), 4)
+
+
+class SplitTtlCutTest(unittest.TestCase):
+    def test_comment_ending_in_dot_does_not_end_statement(self):
+        ttl = (
+            b"@prefix ex: <http://a/> .\n\n"
+            b"ex:s1 ex:p ex:o ;\n"
+            b"  # nota.\n"
+            b"\n"
+            b"  ex:q ex:o .\n"
+        )
+        parts = split(ttl)
+        # solo se corta tras la directiva, nunca dentro de la sentencia de ex:s1
+        self.assertEqual(len(parts), 2)
+        self.assertIn(b"ex:s1 ex:p ex:o ;", parts[1])
+        self.assertIn(b"ex:q ex:o .", parts[1])
+
+    def test_parts_respect_size(self):
+        ttl = b"".join(
+            b"<http://a/s%d> <http://a/p> <http://a/o> .\n\n" % i for i in range(100)
+        )
+        parts = split(ttl, part_size=500)
+        self.assertGreater(len(parts), 1)
+        self.assertEqual(b"".join(parts), ttl)
+
+
+if __name__ == "__main__":
+    unittest.main()